@@ -0,0 +1,131 @@
+# src/query_cache.py
+import os
+import time
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticQueryCache:
+    """
+    최근 쿼리 임베딩 → 검색 결과(hits) 캐시. 메모리(LRU) + 디스크(pickle).
+    - 같은 문자열이면 임베딩 호출 없이 바로 반환
+    - 아니면 쿼리 임베딩과 캐시된 임베딩의 코사인 유사도 >= threshold면 캐시 결과 반환
+      (예: "나무 사진" / "숲 속 나무" 처럼 비전 요약이 거의 같은 경우)
+    - ttl_sec 지난 항목은 무시/삭제, max_entries 넘으면 가장 오래 안 쓴 것부터 제거
+    namespace(보통 인덱스 경로)가 다르면 디스크 캐시는 버림 — 인덱스가 바뀌면 결과도 달라지므로.
+    hit/miss 카운터도 디스크에 누적 → stats()의 hit_rate는 여러 실행에 걸친 값.
+    """
+
+    def __init__(self, path=None, threshold=0.92, ttl_sec=24 * 3600, max_entries=256, namespace=""):
+        self.path = path
+        self.threshold = threshold
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.entries = OrderedDict()  # query -> {"vec", "k", "hits", "ts"}
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self._load()
+
+    # ----------------------------
+    # 조회 / 저장
+    # ----------------------------
+    def get_exact(self, query, k):
+        self._evict_expired()
+        e = self.entries.get(query)
+        if e is None or e["k"] < k:
+            return None
+        self.entries.move_to_end(query)
+        self.hits["exact"] += 1
+        self._save()  # 카운터 / LRU 순서 반영
+        return [dict(h) for h in e["hits"][:k]]
+
+    def lookup(self, vec, k):
+        """vec: (1, d) 또는 (d,) 쿼리 임베딩. 임계값 넘는 가장 유사한 항목의 hits, 없으면 None."""
+        self._evict_expired()
+        keys = [q for q, e in self.entries.items() if e["k"] >= k]
+        if not keys:
+            self.misses += 1
+            return None
+        q = _unit(vec)
+        mat = np.stack([self.entries[key]["vec"] for key in keys])
+        sims = mat @ q
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(keys[best])
+        self.hits["semantic"] += 1
+        self._save()
+        return [dict(h) for h in self.entries[keys[best]]["hits"][:k]]
+
+    def put(self, query, vec, k, hits):
+        self.entries[query] = {"vec": _unit(vec), "k": k, "hits": [dict(h) for h in hits], "ts": time.time()}
+        self.entries.move_to_end(query)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._save()
+
+    def clear(self):
+        self.entries.clear()
+        self._save()
+
+    def stats(self):
+        n_hit = self.hits["exact"] + self.hits["semantic"]
+        total = n_hit + self.misses
+        return {
+            "size": len(self.entries),
+            "exact_hits": self.hits["exact"],
+            "semantic_hits": self.hits["semantic"],
+            "misses": self.misses,
+            "hit_rate": n_hit / total if total else 0.0,
+        }
+
+    # ----------------------------
+    # 내부
+    # ----------------------------
+    def _evict_expired(self):
+        if not self.ttl_sec:
+            return
+        now = time.time()
+        for q in [q for q, e in self.entries.items() if now - e["ts"] > self.ttl_sec]:
+            del self.entries[q]
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                blob = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+        if not isinstance(blob, dict) or blob.get("namespace") != self.namespace:
+            return  # 깨진/예전 파일이거나 인덱스가 바뀜 → 항목과 hit/miss 카운터 모두 새로 시작
+        self.entries = OrderedDict(blob.get("entries", []))
+        # 실행 1회당 쿼리 1개라 카운터도 파일에 누적해야 hit_rate가 의미 있음
+        self.hits = {"exact": 0, "semantic": 0, **blob.get("hits", {})}
+        self.misses = blob.get("misses", 0)
+        self._evict_expired()
+
+    def _save(self):
+        if not self.path:
+            return
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({
+                "namespace": self.namespace,
+                "entries": list(self.entries.items()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }, f)
+        os.replace(tmp, self.path)  # 쓰다 죽어도 기존 캐시 파일은 안 깨지게
+
+
+def _unit(vec):
+    v = np.asarray(vec, dtype="float32").reshape(-1)
+    return v / max(float(np.linalg.norm(v)), 1e-12)
@@ -6,14 +6,16 @@ import pathlib
 import requests
 import urllib.parse
 # from mr_extract import extract_mr   # ❌ spleeter 관련 제거
-from typing import Dict, Any, List, Union, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from openai import OpenAI
 from vision_to_query import image_to_query
 from search_lyrics import LyricsSearcher
+from query_cache import SemanticQueryCache
 from agents import debate_and_merge
 from compose_prompt import build_suno_prompt
+from stage_graph import StageGraph
 
 
 # os.environ.setdefault("SPLEETER_MODEL_PATH", r"C:\ai\models\spleeter")  # ❌ spleeter 관련 제거
@@ -51,6 +53,33 @@ def _get_env(key: str, required: bool = False, default: str = "") -> str:
         raise RuntimeError(f"{key} 없어서 진행 불가")
     return v
 
+def _searcher_config(api_key: str) -> Dict[str, Any]:
+    """
+    배포 환경별 검색 설정.
+    SEARCH_MODE=flat(기본)      : LYRICS_INDEX_PATH의 1536차원 Flat 인덱스
+    SEARCH_MODE=two_stage       : LYRICS_COMPACT_INDEX_PATH(축소 차원) → LYRICS_FULL_STORE_PATH(.npy) 재정렬
+    """
+    cfg: Dict[str, Any] = {
+        "index_path": _get_env("LYRICS_INDEX_PATH", default="C:/ai/data/songs.index"),
+        "meta_path": _get_env("LYRICS_META_PATH", default="C:/ai/data/songs_meta.pkl"),
+        "api_key": api_key,
+    }
+    if _get_env("SEARCH_MODE", default="flat") == "two_stage":
+        cfg["index_path"] = _get_env("LYRICS_COMPACT_INDEX_PATH", default="C:/ai/data/songs_compact.index")
+        cfg["full_path"] = _get_env("LYRICS_FULL_STORE_PATH", default="C:/ai/data/songs_full.npy")
+        cfg["rerank_factor"] = int(_get_env("RERANK_FACTOR", default="4"))
+
+    # 유사 쿼리 캐시 (인덱스 경로+수정시각을 namespace로 → 인덱스 다시 만들면 캐시 무효)
+    index_mtime = os.path.getmtime(cfg["index_path"]) if os.path.exists(cfg["index_path"]) else 0
+    cfg["cache"] = SemanticQueryCache(
+        path=_get_env("QUERY_CACHE_PATH", default="C:/ai/data/query_cache.pkl"),
+        threshold=float(_get_env("QUERY_CACHE_THRESHOLD", default="0.92")),
+        ttl_sec=int(_get_env("QUERY_CACHE_TTL_SEC", default=str(24 * 3600))),
+        max_entries=int(_get_env("QUERY_CACHE_MAX", default="256")),
+        namespace=f"{cfg['index_path']}@{index_mtime}",
+    )
+    return cfg
+
 def _ensure_outputs_dir() -> pathlib.Path:
     out = pathlib.Path(__file__).resolve().parent.parent / "outputs"
     out.mkdir(parents=True, exist_ok=True)
@@ -317,6 +346,37 @@ def download_audio(url: str, save_dir: pathlib.Path, filename: str = None) -> pa
                     f.write(chunk)
     return path
 
+def _generate_and_save(payload: Dict[str, Any], suffix: str, suno_key: str, suno_base: str,
+                       outdir: pathlib.Path) -> List[pathlib.Path]:
+    mode = "Instrumental" if payload.get("instrumental") else "Vocal"
+    print(f"\n🎵 Suno 음악 생성 중... ({mode})")
+    result = suno_generate_and_wait(payload, api_key=suno_key, base_url=suno_base)
+    tracks: List[Dict[str, Any]] = (result.get("tracks", []) or [])[:1]
+
+    print(f"\n생성 완료! (task_id={result['task_id']})  저장 경로: {outdir}")
+    saved = []
+    for i, t in enumerate(tracks, 1):
+        title = t.get("title") or f"track_{i}"
+        duration = t.get("duration")
+        audio_url = (
+            t.get("sourceAudioUrl")
+            or t.get("audioUrl")
+            or t.get("streamAudioUrl")
+            or t.get("audio_url")
+        )
+        print(f"[트랙 {i}] {title} — {duration}s")
+        print("URL:", audio_url)
+        if not audio_url:
+            print("⚠ 오디오 URL이 비었습니다. 다음 트랙으로 넘어갑니다.")
+            continue
+
+        safe = "".join(ch if ch.isalnum() or ch in " ._-" else "_" for ch in title)
+        filename = f"{i:02d}_{safe}{suffix}.mp3"
+        pth = download_audio(audio_url, outdir, filename=filename)
+        print("저장:", pth)
+        saved.append(pth)
+    return saved
+
 # ----------------------------
 # 메인 파이프라인
 # ----------------------------
@@ -332,124 +392,70 @@ def main(image_path):
     make_inst_only = os.getenv("MAKE_INSTRUMENTAL") == "1"  # MR만
     make_both      = os.getenv("MAKE_BOTH") == "1"          # 보컬+MR 둘 다
 
+    # 단계 그래프: 의존성이 끝난 단계부터 바로 시작
+    #   query(비전) ─┐
+    #   searcher ────┴→ hits ─┐
+    #   client ───────────────┴→ merged → payload → suno_*(보컬/MR 동시)
+    graph = StageGraph()
+
     # 1) 이미지 → 쿼리
-    query = image_to_query(image_path, api_key)
-    print("쿼리:", query)
-
-    # 2) 벡터 검색
-    searcher = LyricsSearcher(
-        index_path="C:/ai/data/songs.index",
-        meta_path="C:/ai/data/songs_meta.pkl",
-        api_key=api_key
-    )
-    hits = searcher.search(query, k=5)
-    print("후보 개수:", len(hits))
-
-    # 3) MAS로 합의 가사
-    client = OpenAI(api_key=api_key)
-    merged = debate_and_merge(client, query, hits)
-    print("\n[합의 가사]\n", merged)
-
-    # 4) Suno 프롬프트 (커스텀 모드용)
-    suno_payload: Union[str, Dict[str, Any]] = build_suno_prompt(merged)
-    suno_payload = _normalize_suno_payload(suno_payload)
-    callback_url = _get_env("SUNO_CALLBACK_URL", default="https://httpbin.org/post")
-    suno_payload.setdefault("callBackUrl", callback_url)
-    suno_payload.setdefault("callbackUrl", callback_url)
-
-    base_payload = dict(suno_payload)
-
-    if isinstance(suno_payload, str):
-        # 혹시 문자열만 올 경우 대비(가사만 온 경우)
-        suno_payload = {
-            "customMode": True,
-            "instrumental": False,
-            "model": "V4_5",
-            "style": "K-pop ballad / warm female vocal / soft piano & strings / 85–92 BPM",
-            "title": "MAS Demo Track",
-            "prompt": suno_payload
-        }
-    
-     # 생성할 목록 구성
-    payloads: List[Tuple[Dict[str, Any], str]] = []
+    def _query():
+        q = image_to_query(image_path, api_key)
+        print("쿼리:", q)
+        return q
+    graph.add("query", _query)
+
+    # 2) 인덱스/메타데이터 로드 (SEARCH_MODE=two_stage면 compact 인덱스 + 원본 memmap) — 비전 호출과 동시에
+    graph.add("searcher", lambda: LyricsSearcher(**_searcher_config(api_key)))
+
+    # 3) 에이전트용 OpenAI 클라이언트 — 검색과 동시에
+    graph.add("client", lambda: OpenAI(api_key=api_key))
+
+    # 4) 벡터 검색
+    def _hits(query, searcher):
+        cache_bypass = os.getenv("QUERY_CACHE_BYPASS") == "1"
+        hits = searcher.search(query, k=5, use_cache=not cache_bypass)
+        print("후보 개수:", len(hits), "| 검색 시간:", searcher.last_timing, "| 메모리:", searcher.memory_report())
+        print("쿼리 캐시:", searcher.cache.stats())
+        return hits
+    graph.add("hits", _hits, deps=("query", "searcher"))
+
+    # 5) MAS로 합의 가사
+    def _merged(client, query, hits):
+        merged = debate_and_merge(client, query, hits)
+        print("\n[합의 가사]\n", merged)
+        return merged
+    graph.add("merged", _merged, deps=("client", "query", "hits"))
+
+    # 6) Suno 프롬프트 (커스텀 모드용)
+    def _payload(merged):
+        suno_payload = _normalize_suno_payload(build_suno_prompt(merged))
+        callback_url = _get_env("SUNO_CALLBACK_URL", default="https://httpbin.org/post")
+        suno_payload.setdefault("callBackUrl", callback_url)
+        suno_payload.setdefault("callbackUrl", callback_url)
+        return suno_payload
+    graph.add("payload", _payload, deps=("merged",))
+
+    # 7) Suno 생성 + 저장 — 보컬/MR 둘 다면 두 작업을 동시에 요청
     if make_both:
-        p1 = dict(base_payload); p1["instrumental"] = False  # 보컬 포함
-        p2 = dict(base_payload); p2["instrumental"] = True   # MR만
-        payloads.append((p1, ""))         # 파일명 접미사 없음 (보컬)
-        payloads.append((p2, "_inst"))    # _inst 붙여서 저장 (MR)
+        variants = [(False, ""), (True, "_inst")]   # 보컬(접미사 없음), MR(_inst)
     else:
-        p = dict(base_payload)
-        p["instrumental"] = bool(make_inst_only)  # True면 MR, False면 보컬
-        payloads.append((p, "_inst" if make_inst_only else ""))
-
-    outdir = _ensure_outputs_dir()
-
-    for idx, (payload, suffix) in enumerate(payloads, start=1):
-        mode = "Instrumental" if payload.get("instrumental") else "Vocal"
-        print(f"\n🎵 Suno 음악 생성 중... ({mode})")
-        result = suno_generate_and_wait(payload, api_key=suno_key, base_url=suno_base)
-        tracks: List[Dict[str, Any]] = (result.get("tracks", []) or [])[:1]
-
-        print(f"\n생성 완료! (task_id={result['task_id']})  저장 경로: {outdir}")
-        for i, t in enumerate(tracks, 1):
-            title = t.get("title") or f"track_{i}"
-            duration = t.get("duration")
-            audio_url = (
-                t.get("sourceAudioUrl")
-                or t.get("audioUrl")
-                or t.get("streamAudioUrl")
-                or t.get("audio_url")
-            )
-            dur_txt = f"{duration}s" if duration is not None else "unknown"
-            print(f"[트랙 {i}] {title} — {duration}s")
-            print("URL:", audio_url)
-            if not audio_url:
-                print("⚠ 오디오 URL이 비었습니다. 다음 트랙으로 넘어갑니다.")
-                continue
-
-            safe = "".join(ch if ch.isalnum() or ch in " ._-" else "_" for ch in title)
-            filename = f"{i:02d}_{safe}{suffix}.mp3"
-            pth = download_audio(audio_url, outdir, filename=filename)
-            print("저장:", pth)
-    return
-    
-    print("\n[Suno 요청 페이로드]\n", json.dumps(suno_payload, ensure_ascii=False, indent=2))
-
-    dry_run = os.getenv("DRY_RUN", "0") == "1"
-    if dry_run:
-        print("\n[DRY RUN] Suno 호출을 생략합니다. (크레딧 사용 없음)")
-        print("[DRY RUN] 파이프라인은 정상이며, 여기서 Suno API만 빠졌습니다.")
-        return
-
-    # 5) Suno 생성
-    print("\n🎵 Suno 음악 생성 중...")
-    result = suno_generate_and_wait(suno_payload, api_key=suno_key, base_url=suno_base)
-    tracks: List[Dict[str, Any]] = (result.get("tracks", []) or [])[:1]
-
+        variants = [(bool(make_inst_only), "_inst" if make_inst_only else "")]
 
-    # 6) 결과 출력 + 저장
     outdir = _ensure_outputs_dir()
-    print(f"\n생성 완료! (task_id={result['task_id']})  저장 경로: {outdir}")
-    for i, t in enumerate(tracks, 1):
-        title = t.get("title") or f"track_{i}"
-        duration = t.get("duration")
-        # URL 우선순위 강화
-        audio_url = (
-            t.get("sourceAudioUrl") or
-            t.get("audioUrl") or
-            t.get("streamAudioUrl") or
-            t.get("audio_url")
-        )
-        print(f"[트랙 {i}] {title} — {duration}s")
-        print("URL:", audio_url)
-        if not audio_url:
-            print("⚠ 오디오 URL이 비었습니다. 다음 트랙으로 넘어갑니다.")
-            continue
+    for instrumental, suffix in variants:
+        def _suno(payload, instrumental=instrumental, suffix=suffix):
+            p = dict(payload)
+            p["instrumental"] = instrumental  # True면 MR, False면 보컬
+            return _generate_and_save(p, suffix, suno_key, suno_base, outdir)
+        graph.add("suno_inst" if instrumental else "suno_vocal", _suno, deps=("payload",))
 
-        if audio_url:
-            safe = "".join(ch if ch.isalnum() or ch in " ._-" else "_" for ch in title)
-            p = download_audio(audio_url, outdir, filename=f"{i:02d}_{safe}.mp3")
-            print("저장:", p)
+    try:
+        graph.run()
+    finally:
+        # 실패/타임아웃 때도 어느 단계에서 시간이 걸렸는지 확인
+        print()
+        graph.report()
 
 if __name__ == "__main__":
     # 예시 경로 수정 필요
@@ -1,28 +1,191 @@
 # src/search_lyrics.py
+import os
+import time
 import numpy as np
 import faiss
 import pickle
 from openai import OpenAI
 
+# 1단계(축소 차원) 인덱스 저장 형식: float32 그대로 / float16 / int8 스칼라 양자화
+COMPACT_DTYPES = {
+    "float32": None,  # 양자화 없이 IndexFlatIP
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def truncate_normalize(vecs, dim):
+    """
+    text-embedding-3 계열은 앞쪽 dim개만 잘라 다시 L2 정규화해도 임베딩으로 쓸 수 있음.
+    (API의 dimensions 파라미터와 같은 결과)
+    """
+    v = np.ascontiguousarray(np.asarray(vecs, dtype="float32")[:, :dim])
+    norms = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.maximum(norms, 1e-12)
+
+
+def _index_mb(index):
+    """인덱스 벡터 코드 크기(MB). serialize_index로 통째 복사하지 않고 개수 × 코드 크기로 계산."""
+    return index.ntotal * index.sa_code_size() / 1e6
+
+
+def build_two_stage_store(emb_array, out_dir, first_dim=256, compact_dtype="float16"):
+    """
+    전체 임베딩(N, 1536)으로 2단계 검색용 파일을 만든다.
+    - songs_compact.index : 축소 차원(first_dim) + 정규화된 1단계 인덱스 (내적 = 코사인)
+    - songs_full.npy      : 재정렬용 원본 float32 벡터 (검색 시 memmap으로 열림)
+    """
+    if compact_dtype not in COMPACT_DTYPES:
+        raise ValueError(f"compact_dtype은 {list(COMPACT_DTYPES)} 중 하나여야 함: {compact_dtype}")
+    os.makedirs(out_dir, exist_ok=True)
+    full = np.ascontiguousarray(np.asarray(emb_array, dtype="float32"))
+    small = truncate_normalize(full, first_dim)
+
+    if COMPACT_DTYPES[compact_dtype] is None:
+        index = faiss.IndexFlatIP(first_dim)
+    else:
+        index = faiss.IndexScalarQuantizer(
+            first_dim, COMPACT_DTYPES[compact_dtype], faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(small)
+    index.add(small)
+
+    compact_path = os.path.join(out_dir, "songs_compact.index")
+    full_path = os.path.join(out_dir, "songs_full.npy")
+    faiss.write_index(index, compact_path)
+    np.save(full_path, full)
+    return compact_path, full_path
+
+
+def two_stage_search(compact_index, full_store, qv, k=5, rerank_factor=4):
+    """
+    전체 차원 쿼리 벡터 qv(1, d)로 2단계 검색. 반환 형식은 faiss search와 동일 (D, I).
+    compact_index에서 k * rerank_factor 후보 → full_store 원본 벡터로 재정렬.
+    """
+    n_cand = min(k * rerank_factor, compact_index.ntotal)
+    q_small = truncate_normalize(qv, compact_index.d)
+    _, cand = compact_index.search(q_small, n_cand)
+    cand = cand[0][cand[0] >= 0]
+
+    # memmap은 정렬된 인덱스로 읽는 게 디스크 접근에 유리
+    cand = np.sort(cand)
+    vecs = np.asarray(full_store[cand], dtype="float32")
+    dist = ((vecs - qv[0]) ** 2).sum(axis=1)  # IndexFlatL2와 같은 제곱 L2
+    order = np.argsort(dist)[:k]
+
+    D = np.full((1, k), np.inf, dtype="float32")
+    I = np.full((1, k), -1, dtype="int64")
+    D[0, :len(order)] = dist[order]
+    I[0, :len(order)] = cand[order]
+    return D, I
+
+
 class LyricsSearcher:
-    def __init__(self, index_path, meta_path, api_key, emb_model="text-embedding-3-small"):
+    """
+    기본: index_path의 Flat 인덱스로 1단계 검색 (기존 동작).
+    full_path를 주면 2단계 모드:
+      1) index_path = 축소 차원 compact 인덱스에서 k * rerank_factor 후보 추출
+      2) full_path(.npy, memmap)의 원본 벡터로 L2 거리 재계산 → 최종 k
+    쿼리 임베딩은 전체 차원으로 한 번만 받고, 1단계용은 로컬에서 잘라 씀.
+    cache(SemanticQueryCache)를 주면 유사 쿼리는 캐시된 hits를 반환 (search의 use_cache=False로 우회).
+    """
+
+    def __init__(self, index_path, meta_path, api_key, emb_model="text-embedding-3-small",
+                 full_path=None, rerank_factor=4, cache=None):
         self.index = faiss.read_index(index_path)
         with open(meta_path, "rb") as f:
             self.meta = pickle.load(f)  # list[dict]
         self.client = OpenAI(api_key=api_key)
         self.emb_model = emb_model
 
+        self.full = np.load(full_path, mmap_mode="r") if full_path else None
+        self.rerank_factor = max(int(rerank_factor), 1)
+        self.cache = cache
+        self.last_timing = {}
+
+    @property
+    def two_stage(self):
+        return self.full is not None
+
     def embed(self, text):
         emb = self.client.embeddings.create(model=self.emb_model, input=text).data[0].embedding
         return np.array(emb, dtype="float32")[None, :]  # (1, d)
 
-    def search(self, query, k=5):
+    def search(self, query, k=5, use_cache=True):
+        cache = self.cache if use_cache else None
+        t0 = time.perf_counter()
+        if cache is not None:
+            cached = cache.get_exact(query, k)
+            if cached is not None:
+                self.last_timing = {"cache": "exact", "embed_ms": 0.0, "search_ms": 0.0}
+                return cached
+
         qv = self.embed(query)
-        D, I = self.index.search(qv, k)
+        t1 = time.perf_counter()
+        if cache is not None:
+            cached = cache.lookup(qv, k)
+            if cached is not None:
+                self.last_timing = {"cache": "semantic", "embed_ms": (t1 - t0) * 1000, "search_ms": 0.0}
+                return cached
+
+        if self.two_stage:
+            D, I = two_stage_search(self.index, self.full, qv, k, self.rerank_factor)
+        else:
+            D, I = self.index.search(qv, k)
+        t2 = time.perf_counter()
+        self.last_timing = {
+            "cache": "miss" if cache is not None else ("bypass" if self.cache is not None else "off"),
+            "embed_ms": (t1 - t0) * 1000,
+            "search_ms": (t2 - t1) * 1000,
+        }
+
         hits = []
         for rank, idx in enumerate(I[0]):
+            if idx < 0:
+                continue
             item = dict(self.meta[idx])
             item["rank"] = rank + 1
             item["score_l2"] = float(D[0][rank])
             hits.append(item)
-        return hits
\ No newline at end of file
+        if cache is not None:
+            cache.put(query, qv, k, hits)
+        return hits
+
+    def memory_report(self):
+        """현재 설정에서 상주 메모리(인덱스) / 디스크 memmap 크기 (MB)."""
+        full_mb = self.full.nbytes / 1e6 if self.two_stage else 0.0
+        return {"index_mb": _index_mb(self.index), "full_store_mb_on_disk": full_mb}
+
+
+def compare_search_modes(flat_index_path, compact_index_path, full_path,
+                         k=5, rerank_factor=4, n_queries=100, seed=0):
+    """
+    단일 단계 Flat 검색 vs 2단계(compact + memmap 재정렬) 비교.
+    저장된 벡터 일부를 쿼리로 써서 API 호출 없이 메모리 / 지연 / recall@k를 측정.
+    """
+    flat = faiss.read_index(flat_index_path)
+    compact = faiss.read_index(compact_index_path)
+    full = np.load(full_path, mmap_mode="r")
+
+    rng = np.random.default_rng(seed)
+    q_ids = rng.choice(full.shape[0], size=min(n_queries, full.shape[0]), replace=False)
+    queries = np.asarray(full[np.sort(q_ids)], dtype="float32")
+
+    t0 = time.perf_counter()
+    flat_I = [flat.search(q[None, :], k)[1][0] for q in queries]
+    t1 = time.perf_counter()
+    two_I = [two_stage_search(compact, full, q[None, :], k, rerank_factor)[1][0] for q in queries]
+    t2 = time.perf_counter()
+
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(flat_I, two_I)])
+    report = {
+        "flat_index_mb": _index_mb(flat),
+        "compact_index_mb": _index_mb(compact),
+        "full_store_mb_on_disk": full.nbytes / 1e6,
+        "flat_ms_per_query": (t1 - t0) * 1000 / len(queries),
+        "two_stage_ms_per_query": (t2 - t1) * 1000 / len(queries),
+        f"recall@{k}": float(recall),
+    }
+    for key, val in report.items():
+        print(f"{key:>24}: {val:.3f}")
+    return report
@@ -0,0 +1,86 @@
+# src/stage_graph.py
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class StageGraph:
+    """
+    파이프라인 단계를 의존성 그래프로 실행.
+    - add(name, fn, deps): fn은 의존 단계 결과를 키워드 인자(단계 이름)로 받음
+    - run(): 의존성이 다 끝난 단계부터 스레드로 바로 시작 → 서로 독립인 단계는 겹쳐서 실행
+      (대부분 OpenAI/Suno 네트워크 대기라 스레드로 충분)
+    - critical_path(): 끝-끝 지연을 결정한 단계 사슬
+    """
+
+    def __init__(self):
+        self.stages = {}   # name -> (fn, deps)
+        self.results = {}
+        self.timings = {}  # name -> (start, end), run() 시작 기준 초
+
+    def add(self, name, fn, deps=()):
+        if name in self.stages:
+            raise ValueError(f"중복 단계 이름: {name}")
+        missing = [d for d in deps if d not in self.stages]
+        if missing:
+            # 먼저 추가된 단계만 의존 가능 → 순환 불가
+            raise ValueError(f"{name}: 아직 없는 의존 단계 {missing}")
+        self.stages[name] = (fn, tuple(deps))
+        return self
+
+    def run(self, max_workers=None):
+        self.results.clear()
+        self.timings.clear()
+        t0 = time.perf_counter()
+
+        def _call(name):
+            fn, deps = self.stages[name]
+            start = time.perf_counter() - t0
+            try:
+                return fn(**{d: self.results[d] for d in deps})
+            finally:
+                self.timings[name] = (start, time.perf_counter() - t0)
+
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.stages) or 1) as pool:
+            while pending or running:
+                for name in [n for n, (_, deps) in pending.items() if all(d in self.results for d in deps)]:
+                    running[pool.submit(_call, name)] = name
+                    del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = running.pop(fut)
+                    err = fut.exception()
+                    if err is not None:
+                        # 이미 돌고 있는 단계는 끝까지 기다리고, 아직 시작 안 한 단계는 버림
+                        for f in running:
+                            f.cancel()
+                        raise err
+                    self.results[name] = fut.result()
+        return self.results
+
+    def critical_path(self):
+        """가장 늦게 끝난 단계에서 시작해, 가장 늦게 끝난 의존 단계를 따라 거슬러 올라감."""
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while True:
+            deps = [d for d in self.stages[name][1] if d in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda d: self.timings[d][1])
+            path.append(name)
+        return path[::-1]
+
+    def report(self):
+        crit = set(self.critical_path())
+        lines = ["[Stage] 단계별 시간 (* = critical path)"]
+        for name, (start, end) in sorted(self.timings.items(), key=lambda kv: kv[1][0]):
+            mark = "*" if name in crit else " "
+            lines.append(f" {mark} {name:<16} {start:7.2f}s → {end:7.2f}s  ({end - start:6.2f}s)")
+        lines.append("[Stage] critical path: " + " → ".join(self.critical_path()))
+        text = "\n".join(lines)
+        print(text)
+        return text
@@ -0,0 +1,117 @@
+# src/utils/near_dup.py
+import re, zlib
+import numpy as np
+
+from utils.text_ko import normalize_ko
+
+# MinHash용 메르센 소수 / 해시 범위
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+def _shingle_text(text: str) -> str:
+    if not isinstance(text, str):  # CSV의 빈 가사(NaN)
+        return ""
+    t = normalize_ko(text)
+    if len(t) < 20:
+        # 한글이 거의 없는 곡(영어 가사 등)은 normalize_ko가 다 지우므로 원문 소문자로 대체
+        t = text.lower()
+    return re.sub(r"\s+", " ", t).strip()
+
+def shingles(text: str, size: int = 4) -> set:
+    """음절 단위 n-gram 집합 (한국어는 띄어쓰기가 들쭉날쭉해서 단어보다 음절이 안정적)"""
+    t = _shingle_text(text)
+    if len(t) <= size:
+        return {t} if t else set()
+    return {t[i:i + size] for i in range(len(t) - size + 1)}
+
+def minhash_signatures(shingle_sets, num_perm: int = 128, seed: int = 0) -> np.ndarray:
+    """(N, num_perm) uint64 MinHash 시그니처. 빈 집합은 최대값으로 채워 어떤 것과도 안 묶임."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+
+    sigs = np.full((len(shingle_sets), num_perm), _MAX_HASH, dtype=np.uint64)
+    for row, sh in enumerate(shingle_sets):
+        if not sh:
+            continue
+        hv = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in sh), dtype=np.uint64, count=len(sh))
+        # (a*x + b) mod p 를 32비트로 자름 — uint64 곱셈 오버플로는 해시 용도라 무방
+        ph = ((hv[:, None] * a[None, :] + b[None, :]) % _PRIME) & _MAX_HASH
+        sigs[row] = ph.min(axis=0)
+    return sigs
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def cluster_near_duplicates(texts, threshold: float = 0.8, num_perm: int = 128,
+                            bands: int = 16, shingle_size: int = 4, seed: int = 0):
+    """
+    MinHash + LSH 밴딩으로 후보 쌍을 찾고, 추정 Jaccard >= threshold인 쌍만 union-find로 묶음.
+    bands=16, rows=8(128/16)이면 LSH 문턱값 ≈ (1/16)^(1/8) ≈ 0.71.
+    반환: 클러스터 리스트 (각 클러스터는 입력 인덱스 리스트)
+    """
+    if num_perm % bands:
+        raise ValueError(f"num_perm({num_perm})은 bands({bands})로 나누어 떨어져야 함")
+    rows = num_perm // bands
+    sets = [shingles(t, shingle_size) for t in texts]
+    sigs = minhash_signatures(sets, num_perm=num_perm, seed=seed)
+
+    parent = list(range(len(texts)))
+    for band in range(bands):
+        buckets = {}
+        chunk = sigs[:, band * rows:(band + 1) * rows]
+        for i in range(len(texts)):
+            if not sets[i]:
+                continue
+            buckets.setdefault(chunk[i].tobytes(), []).append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            head = members[0]
+            for j in members[1:]:
+                ri, rj = _find(parent, head), _find(parent, j)
+                if ri == rj:
+                    continue
+                if np.mean(sigs[head] == sigs[j]) >= threshold:
+                    parent[rj] = ri
+
+    clusters = {}
+    for i in range(len(texts)):
+        clusters.setdefault(_find(parent, i), []).append(i)
+    return list(clusters.values())
+
+def dedup_records(records, text_key: str = "lyric", threshold: float = 0.8, **kw):
+    """
+    곡 레코드(list[dict])에서 가사 기준 근사 중복(리릴리즈/커버)을 묶어 대표 1곡만 남김.
+    대표는 가장 이른 year(동률이면 id 순) — 보통 원곡.
+    대표 레코드에 alt_ids / alt_years / dup_count 추가.
+    반환: (대표 레코드 리스트, 통계 dict)
+    """
+    clusters = cluster_near_duplicates([r.get(text_key, "") for r in records], threshold=threshold, **kw)
+
+    def order(i):
+        r = records[i]
+        y = r.get("year")
+        # None / NaN(pandas 결측) / 숫자 아닌 값은 연도 없음 → 맨 뒤로
+        y = y if isinstance(y, (int, float)) and y == y else float("inf")
+        return (y, str(r.get("id")))
+
+    reps = []
+    for members in sorted(clusters, key=min):  # 원래 순서 유지
+        members = sorted(members, key=order)
+        rep = dict(records[members[0]])
+        rep["alt_ids"] = [records[i].get("id") for i in members[1:]]
+        rep["alt_years"] = [records[i].get("year") for i in members[1:]]
+        rep["dup_count"] = len(members)
+        reps.append(rep)
+
+    stats = {
+        "input": len(records),
+        "kept": len(reps),
+        "removed": len(records) - len(reps),
+        "clusters_with_dups": sum(1 for m in clusters if len(m) > 1),
+    }
+    return reps, stats